@@ -6,43 +6,218 @@ Access from any device on your network to monitor and control screen lock.
 
 from flask import Flask, render_template, jsonify, request
 import subprocess
+import base64
+import atexit
 import json
+import functools
+import re
 import ctypes
+import os
 import sys
 import threading
 import time
+import logging
+import logging.handlers
+import queue
+import socket
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 app = Flask(__name__)
 
+# Settings
+CHECK_INTERVAL = 3.0  # Check every 3 seconds
+OUT_OF_RANGE_COUNT = 2  # Wait for 2 consecutive misses before turning off screen (~6 sec)
+SCREEN_OFF_MIN_GAP = 2.0  # Screen-off requests within 2 seconds of the last one are skipped
+
+# Endpoint names matching this are built-in audio, not Bluetooth:
+# Realtek/internal devices, microphone arrays and non-Bluetooth speakers
+BUILTIN_AUDIO_RE = re.compile(r"realtek|internal|microphone array|^(?!.*bluetooth).*speakers", re.I)
+
+# PowerShell session command line; CREATE_NO_WINDOW keeps it from flashing
+# a console window when BlueLock runs without one
+POWERSHELL_CMD = ("powershell", "-NoProfile", "-NonInteractive", "-NoLogo",
+                  "-ExecutionPolicy", "Bypass", "-Command", "-")
+CREATE_NO_WINDOW = 0x08000000
+SUBPROCESS_FLAGS = CREATE_NO_WINDOW if sys.platform == "win32" else 0
+POWERSHELL_TIMEOUT = 30  # Seconds before a command with no reply kills the session
+
+# Configuration Manager (cfgmgr32.dll) constants
+CR_SUCCESS = 0
+CM_LOCATE_DEVNODE_NORMAL = 0
+DN_STARTED = 0x00000008
+
+# Device list cache - skips the PowerShell enumeration on page loads
+DEVICE_CACHE_FILE = os.path.join(os.environ.get("LOCALAPPDATA") or os.path.expanduser("~"),
+                                 "bluelock", "devices.json")
+DEVICE_CACHE_TTL = 60  # Seconds before the cached list is re-enumerated
+DEVICE_CACHE_SCHEMA = 1  # Bump when the device dict layout changes
+
+
+class MonitorState:
+    """Monitoring state shared by the monitor thread and the API routes."""
+    
+    __slots__ = ("is_monitoring", "device_name", "device_id", "is_connected",
+                 "last_check", "screen_off")
+    
+    def __init__(self):
+        self.is_monitoring = False
+        self.device_name = None
+        self.device_id = None
+        self.is_connected = False
+        self.last_check = None
+        self.screen_off = False
+    
+    def to_dict(self):
+        """Status fields exposed by /api/status."""
+        return {
+            "is_monitoring": self.is_monitoring,
+            "device_name": self.device_name,
+            "device_id": self.device_id,
+            "is_connected": self.is_connected,
+            "last_check": self.last_check,
+            "screen_off": self.screen_off
+        }
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of failing when the queue is full."""
+    
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+class PowerShellSession:
+    """One long-lived PowerShell process that runs commands sent over stdin.
+    
+    Starting powershell.exe costs hundreds of ms, so the process is started
+    once and reused; each reply is terminated by a sentinel line.
+    """
+    
+    SENTINEL = "___BLUELOCK_END___"
+    
+    def __init__(self):
+        self.process = None
+        self.lock = threading.Lock()
+    
+    def start(self):
+        self.process = subprocess.Popen(
+            POWERSHELL_CMD,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+            creationflags=SUBPROCESS_FLAGS
+        )
+        # UTF-8 without a BOM, so no preamble lands in front of a reply
+        self.send("[Console]::OutputEncoding = [System.Text.UTF8Encoding]::new($false)")
+    
+    def send(self, command):
+        # Commands are read line by line, so send the script as one base64
+        # line and run it as a script block - its line breaks stay intact
+        encoded = base64.b64encode(command.encode("utf-8")).decode("ascii")
+        self.process.stdin.write(
+            "& ([scriptblock]::Create([Text.Encoding]::UTF8.GetString("
+            f"[Convert]::FromBase64String('{encoded}'))))\n"
+            f"Write-Output '{self.SENTINEL}'\n"
+        )
+        self.process.stdin.flush()
+        
+        # Reading has no timeout of its own - kill the process if the reply
+        # never ends, which closes stdout and ends the loop below
+        timer = threading.Timer(POWERSHELL_TIMEOUT, self.process.kill)
+        timer.daemon = True
+        timer.start()
+        try:
+            lines = []
+            for out in self.process.stdout:
+                out = out.lstrip("\ufeff").rstrip()
+                if out == self.SENTINEL:
+                    return "\n".join(lines).strip()
+                lines.append(out)
+        finally:
+            timer.cancel()
+        
+        # stdout closed before the sentinel - the process is gone or was killed
+        self.process = None
+        raise OSError("PowerShell session exited")
+    
+    def run(self, command):
+        """Run a command and return its output, (re)starting the process if needed."""
+        with self.lock:
+            try:
+                if self.process is None or self.process.poll() is not None:
+                    self.start()
+                return self.send(command)
+            except BaseException:
+                # A half-read reply (including Ctrl+C mid-read) would leave
+                # output for the next command - start over with a new process
+                self.close()
+                raise
+    
+    def close(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process = None
+
+
+# Logging - the monitor thread only enqueues records, a listener thread
+# writes them to the console
+log_queue = queue.Queue(maxsize=1000)
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", "%H:%M:%S"))
+log_listener = logging.handlers.QueueListener(log_queue, log_handler)
+log_listener.start()
+
+logger = logging.getLogger("bluelock")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+logger.addHandler(DroppingQueueHandler(log_queue))
+
 # Global state
-monitor_state = {
-    "is_monitoring": False,
-    "device_name": None,
-    "device_id": None,
-    "is_connected": False,
-    "last_check": None,
-    "screen_off": False
-}
+monitor_state = MonitorState()
 
 monitor_thread = None
-stop_monitoring = False
+stop_event = threading.Event()
+
+powershell = PowerShellSession()
+atexit.register(powershell.close)
+# Flush queued log records (e.g. "Monitoring stopped") before exiting
+atexit.register(log_listener.stop)
+
+last_screen_off = 0.0
+screen_off_lock = threading.Lock()
+
+# In-memory copy of the device list, in front of the cache file
+cached_devices = None
+cached_devices_expiry = 0.0
+device_cache_generation = 0  # Bumped on invalidation; older lists are not kept
+device_cache_lock = threading.Lock()
 
 
 def run_powershell(command):
-    """Run PowerShell command and return output."""
+    """Run PowerShell command in the shared session and return output."""
     try:
-        result = subprocess.run(
-            ["powershell", "-NoProfile", "-ExecutionPolicy", "Bypass", "-Command", command],
-            capture_output=True,
-            text=True,
-            encoding="utf-8",
-            errors="replace"
-        )
-        return result.stdout.strip()
-    except:
+        return powershell.run(command)
+    except (OSError, ValueError) as e:
+        logger.warning("PowerShell command failed: %s", e)
         return ""
 
 
+@functools.lru_cache(maxsize=256)
+def is_builtin_audio(name):
+    """Check if an audio endpoint is built-in hardware, not a Bluetooth device."""
+    return BUILTIN_AUDIO_RE.search(name) is not None
+
+
 def get_all_bluetooth_devices():
     """Get all paired Bluetooth audio devices."""
     ps_audio = """
@@ -55,85 +230,228 @@ def get_all_bluetooth_devices():
         return []
     
     try:
-        data = json.loads(output)
+        data = json_loads(output)
         if isinstance(data, dict):
             data = [data]
         
-        devices = []
+        # Keyed by instance id so repeated entries collapse to one
+        devices = {}
         for d in data:
             name = (d.get("FriendlyName") or "").strip()
-            instance_id = (d.get("InstanceId") or "").strip()
+            # PnP instance ids are case-insensitive; normalize once here
+            instance_id = (d.get("InstanceId") or "").strip().upper()
             status = (d.get("Status") or "").strip()
             
             if not name or not instance_id:
                 continue
             
-            name_lower = name.lower()
-            
             # Skip built-in audio devices
-            if "realtek" in name_lower:
-                continue
-            if "internal" in name_lower:
-                continue
-            if "speakers" in name_lower and "bluetooth" not in name_lower:
-                continue
-            if "microphone array" in name_lower:
+            if is_builtin_audio(name):
                 continue
             
-            devices.append({
+            devices.setdefault(instance_id, {
                 "name": name,
                 "instance_id": instance_id,
                 "connected": status.upper() == "OK"
             })
-            
-        return devices
-    except:
+        
+        # Connected devices first, otherwise keep PnP order
+        return sorted(devices.values(), key=lambda d: not d["connected"])
+    except (ValueError, AttributeError, TypeError) as e:
+        logger.warning("Could not parse device list: %s", e)
         return []
 
 
+def json_loads(data):
+    """Parse JSON text or bytes, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(obj):
+    """Serialize obj to UTF-8 JSON bytes, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def load_cached_devices():
+    """Return (devices, age in seconds) from the cache file, or None if missing or stale."""
+    try:
+        age = time.time() - os.path.getmtime(DEVICE_CACHE_FILE)
+        if age > DEVICE_CACHE_TTL:
+            return None
+        with open(DEVICE_CACHE_FILE, "rb") as f:
+            cache = json_loads(f.read())
+        if cache.get("schema") != DEVICE_CACHE_SCHEMA:
+            return None
+        return cache["devices"], age
+    except (OSError, ValueError, KeyError, AttributeError):
+        return None
+
+
+def save_cached_devices(devices):
+    """Write the device list to the cache file atomically."""
+    tmp_file = DEVICE_CACHE_FILE + ".tmp"
+    try:
+        os.makedirs(os.path.dirname(DEVICE_CACHE_FILE), exist_ok=True)
+        with open(tmp_file, "wb") as f:
+            f.write(json_dumps({"schema": DEVICE_CACHE_SCHEMA, "devices": devices}))
+            # Make sure the data is on disk before it replaces the old file
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, DEVICE_CACHE_FILE)
+    except (OSError, TypeError) as e:
+        logger.warning("Could not write device cache: %s", e)
+
+
+def invalidate_device_cache():
+    """Forget the cached device list so the next request enumerates again.
+    
+    Called from the monitor thread, so it does not wait for device_cache_lock.
+    A list being loaded or enumerated meanwhile is dropped when it finishes.
+    """
+    global cached_devices, device_cache_generation
+    
+    device_cache_generation += 1
+    cached_devices = None
+    try:
+        os.remove(DEVICE_CACHE_FILE)
+    except OSError:
+        pass
+
+
+def get_devices(refresh=False):
+    """Get the device list, from the cache unless it is stale or refresh is set."""
+    global cached_devices, cached_devices_expiry
+    
+    with device_cache_lock:
+        generation = device_cache_generation
+        cached = None
+        if not refresh:
+            # Memory first, then the cache file
+            devices = cached_devices
+            if devices is not None and time.monotonic() < cached_devices_expiry:
+                return devices
+            cached = load_cached_devices()
+        
+        if cached is not None:
+            devices, age = cached
+            cached_devices = devices
+            cached_devices_expiry = time.monotonic() + DEVICE_CACHE_TTL - age
+        else:
+            devices = get_all_bluetooth_devices()
+            if devices:
+                save_cached_devices(devices)
+                cached_devices = devices
+                cached_devices_expiry = time.monotonic() + DEVICE_CACHE_TTL
+        
+        # The list was loaded or enumerated before an invalidation that landed
+        # meanwhile, so it may show the old connection state - drop it again
+        if generation != device_cache_generation:
+            invalidate_device_cache()
+        return devices
+
+
+def get_devnode_connected(instance_id):
+    """Check the device node in-process via cfgmgr32 (no PowerShell).
+    
+    Returns None when the API is not available.
+    """
+    try:
+        cfgmgr32 = ctypes.windll.cfgmgr32
+    except (AttributeError, OSError):
+        return None
+    
+    devinst = ctypes.c_ulong()
+    if cfgmgr32.CM_Locate_DevNodeW(ctypes.byref(devinst), instance_id, CM_LOCATE_DEVNODE_NORMAL) != CR_SUCCESS:
+        # Device node is not present - the endpoint went away
+        return False
+    
+    status = ctypes.c_ulong()
+    problem = ctypes.c_ulong()
+    if cfgmgr32.CM_Get_DevNode_Status(ctypes.byref(status), ctypes.byref(problem), devinst, 0) != CR_SUCCESS:
+        return False
+    
+    # Same as Get-PnpDevice reporting Status = OK
+    return bool(status.value & DN_STARTED) and problem.value == 0
+
+
+@functools.lru_cache(maxsize=8)
+def status_command(instance_id):
+    """PowerShell status query for a device, built once per monitored device."""
+    return f'(Get-PnpDevice -InstanceId "{instance_id}").Status'
+
+
 def is_device_connected(instance_id):
     """Check if device is still connected."""
-    ps_command = f'(Get-PnpDevice -InstanceId "{instance_id}").Status'
-    status = run_powershell(ps_command)
+    connected = get_devnode_connected(instance_id)
+    if connected is not None:
+        return connected
+    
+    # Fall back to PowerShell
+    status = run_powershell(status_command(instance_id))
     return status.upper() == "OK"
 
 
 def turn_off_screen():
     """Turn off the monitor."""
+    global last_screen_off
+    
     if sys.platform == "win32":
+        # Coalesce repeated requests (double clicks, several dashboards, monitor)
+        with screen_off_lock:
+            now = time.monotonic()
+            if now - last_screen_off < SCREEN_OFF_MIN_GAP:
+                return True
+            last_screen_off = now
+        
         HWND_BROADCAST = 0xFFFF
         WM_SYSCOMMAND = 0x0112
         SC_MONITORPOWER = 0xF170
-        ctypes.windll.user32.SendMessageW(HWND_BROADCAST, WM_SYSCOMMAND, SC_MONITORPOWER, 2)
+        # PostMessage returns immediately; SendMessage to HWND_BROADCAST blocks
+        # until every top-level window has handled the message
+        ctypes.windll.user32.PostMessageW(HWND_BROADCAST, WM_SYSCOMMAND, SC_MONITORPOWER, 2)
         return True
     return False
 
 
-def monitor_loop():
-    """Background monitoring loop."""
-    global monitor_state, stop_monitoring
+def monitor_loop(stop):
+    """Background monitoring loop, runs until its stop event is set."""
+    st = monitor_state
+    # Fixed for the whole session - /api/start sets them before starting the thread
+    device_id = st.device_id
+    device_name = st.device_name
     
-    miss_count = 0
-    OUT_OF_RANGE_COUNT = 2
+    misses = 0
     
-    while not stop_monitoring and monitor_state["is_monitoring"]:
-        if monitor_state["device_id"]:
-            connected = is_device_connected(monitor_state["device_id"])
-            monitor_state["is_connected"] = connected
-            monitor_state["last_check"] = time.strftime("%H:%M:%S")
-            
-            if connected:
-                miss_count = 0
-                monitor_state["screen_off"] = False
-            else:
-                miss_count += 1
-                if miss_count >= OUT_OF_RANGE_COUNT and not monitor_state["screen_off"]:
-                    turn_off_screen()
-                    monitor_state["screen_off"] = True
+    while not stop.is_set() and st.is_monitoring:
+        started = time.monotonic()
+        connected = is_device_connected(device_id)
+        if st.last_check is not None and connected != st.is_connected:
+            # The cached list shows the old connection state
+            invalidate_device_cache()
+        st.is_connected = connected
+        st.last_check = time.strftime("%H:%M:%S")
+        
+        if connected:
+            if st.screen_off:
+                logger.info("%s reconnected", device_name)
+            misses = 0
+            st.screen_off = False
+        else:
+            misses += 1
+            if misses >= OUT_OF_RANGE_COUNT and not st.screen_off:
+                logger.info("%s disconnected - turning off screen", device_name)
+                turn_off_screen()
+                st.screen_off = True
         
-        time.sleep(3)
+        # Subtract the time the check took so the cadence stays steady;
+        # wakes up immediately when monitoring is stopped
+        stop.wait(max(0.0, CHECK_INTERVAL - (time.monotonic() - started)))
     
-    monitor_state["is_monitoring"] = False
+    st.is_monitoring = False
 
 
 # Routes
@@ -145,21 +463,21 @@ def index():
 
 @app.route("/api/devices")
 def api_devices():
-    """Get list of Bluetooth devices."""
-    devices = get_all_bluetooth_devices()
+    """Get list of Bluetooth devices (?refresh=1 skips the cache)."""
+    devices = get_devices(refresh=request.args.get("refresh") == "1")
     return jsonify({"devices": devices})
 
 
 @app.route("/api/status")
 def api_status():
     """Get current monitoring status."""
-    return jsonify(monitor_state)
+    return jsonify(monitor_state.to_dict())
 
 
 @app.route("/api/start", methods=["POST"])
 def api_start():
     """Start monitoring a device."""
-    global monitor_thread, stop_monitoring, monitor_state
+    global monitor_thread, stop_event
     
     data = request.get_json()
     device_name = data.get("device_name")
@@ -169,20 +487,23 @@ def api_start():
         return jsonify({"error": "No device selected"}), 400
     
     # Stop existing monitoring
-    stop_monitoring = True
+    stop_event.set()
     if monitor_thread and monitor_thread.is_alive():
         monitor_thread.join(timeout=5)
     
     # Start new monitoring
-    stop_monitoring = False
-    monitor_state["is_monitoring"] = True
-    monitor_state["device_name"] = device_name
-    monitor_state["device_id"] = device_id
-    monitor_state["is_connected"] = is_device_connected(device_id)
-    monitor_state["screen_off"] = False
-    
-    monitor_thread = threading.Thread(target=monitor_loop, daemon=True)
+    stop_event = threading.Event()
+    monitor_state.is_monitoring = True
+    monitor_state.device_name = device_name
+    monitor_state.device_id = device_id
+    # The monitor thread fills these in on its first check
+    monitor_state.is_connected = False
+    monitor_state.last_check = None
+    monitor_state.screen_off = False
+    
+    monitor_thread = threading.Thread(target=monitor_loop, args=(stop_event,), daemon=True)
     monitor_thread.start()
+    logger.info("Monitoring %s", device_name)
     
     return jsonify({"success": True, "message": f"Monitoring {device_name}"})
 
@@ -190,12 +511,11 @@ def api_start():
 @app.route("/api/stop", methods=["POST"])
 def api_stop():
     """Stop monitoring."""
-    global stop_monitoring, monitor_state
-    
-    stop_monitoring = True
-    monitor_state["is_monitoring"] = False
-    monitor_state["device_name"] = None
-    monitor_state["device_id"] = None
+    stop_event.set()
+    monitor_state.is_monitoring = False
+    monitor_state.device_name = None
+    monitor_state.device_id = None
+    logger.info("Monitoring stopped")
     
     return jsonify({"success": True, "message": "Monitoring stopped"})
 
@@ -208,8 +528,11 @@ def api_screen_off():
 
 
 if __name__ == "__main__":
+    # Enumerate devices while the server starts, so the first page load
+    # finds the list already cached
+    threading.Thread(target=get_devices, daemon=True).start()
+    
     # Get local IP for network access
-    import socket
     hostname = socket.gethostname()
     local_ip = socket.gethostbyname(hostname)
     
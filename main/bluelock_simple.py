@@ -10,44 +10,205 @@ Usage: python bluelock_simple.py
 """
 
 import subprocess
+import base64
 import json
+import re
 import time
 import ctypes
 import sys
 import os
+import functools
+import queue
+import threading
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 # Settings
 CHECK_INTERVAL = 3.0  # Check every 3 seconds
 OUT_OF_RANGE_COUNT = 2  # Wait for 2 consecutive misses before turning off screen (~6 sec)
 
+# Endpoint names matching this are built-in audio, not Bluetooth:
+# Realtek/internal devices, microphone arrays and non-Bluetooth speakers
+BUILTIN_AUDIO_RE = re.compile(r"realtek|internal|microphone array|^(?!.*bluetooth).*speakers", re.I)
+
+# PowerShell session command line; CREATE_NO_WINDOW keeps it from flashing
+# a console window when BlueLock runs without one
+POWERSHELL_CMD = ("powershell", "-NoProfile", "-NonInteractive", "-NoLogo",
+                  "-ExecutionPolicy", "Bypass", "-Command", "-")
+CREATE_NO_WINDOW = 0x08000000
+SUBPROCESS_FLAGS = CREATE_NO_WINDOW if sys.platform == "win32" else 0
+POWERSHELL_TIMEOUT = 30  # Seconds before a command with no reply kills the session
+
+# Configuration Manager (cfgmgr32.dll) constants
+CR_SUCCESS = 0
+CM_LOCATE_DEVNODE_NORMAL = 0
+DN_STARTED = 0x00000008
+
+
+class ConsoleWriter:
+    """Writes status lines from a background thread so console I/O never delays a check."""
+    
+    def __init__(self, maxsize=64):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    def write(self, text):
+        """Queue text for output, dropping the oldest text if the queue is full."""
+        while True:
+            try:
+                self.queue.put_nowait(text)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+    
+    def close(self):
+        """Flush queued text and stop the writer thread."""
+        self.write(None)
+        self.thread.join(timeout=1)
+    
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            done = None in batch
+            sys.stdout.write("".join(text for text in batch if text is not None))
+            sys.stdout.flush()
+            if done:
+                return
+
+
+class PowerShellSession:
+    """One long-lived PowerShell process that runs commands sent over stdin.
+    
+    Starting powershell.exe costs hundreds of ms, so the process is started
+    once and reused; each reply is terminated by a sentinel line.
+    """
+    
+    SENTINEL = "___BLUELOCK_END___"
+    
+    def __init__(self):
+        self.process = None
+        self.lock = threading.Lock()
+    
+    def start(self):
+        self.process = subprocess.Popen(
+            POWERSHELL_CMD,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+            creationflags=SUBPROCESS_FLAGS
+        )
+        # UTF-8 without a BOM, so no preamble lands in front of a reply
+        self.send("[Console]::OutputEncoding = [System.Text.UTF8Encoding]::new($false)")
+    
+    def send(self, command):
+        # Commands are read line by line, so send the script as one base64
+        # line and run it as a script block - its line breaks stay intact
+        encoded = base64.b64encode(command.encode("utf-8")).decode("ascii")
+        self.process.stdin.write(
+            "& ([scriptblock]::Create([Text.Encoding]::UTF8.GetString("
+            f"[Convert]::FromBase64String('{encoded}'))))\n"
+            f"Write-Output '{self.SENTINEL}'\n"
+        )
+        self.process.stdin.flush()
+        
+        # Reading has no timeout of its own - kill the process if the reply
+        # never ends, which closes stdout and ends the loop below
+        timer = threading.Timer(POWERSHELL_TIMEOUT, self.process.kill)
+        timer.daemon = True
+        timer.start()
+        try:
+            lines = []
+            for out in self.process.stdout:
+                out = out.lstrip("\ufeff").rstrip()
+                if out == self.SENTINEL:
+                    return "\n".join(lines).strip()
+                lines.append(out)
+        finally:
+            timer.cancel()
+        
+        # stdout closed before the sentinel - the process is gone or was killed
+        self.process = None
+        raise OSError("PowerShell session exited")
+    
+    def run(self, command):
+        """Run a command and return its output, (re)starting the process if needed."""
+        with self.lock:
+            try:
+                if self.process is None or self.process.poll() is not None:
+                    self.start()
+                return self.send(command)
+            except BaseException:
+                # A half-read reply (including Ctrl+C mid-read) would leave
+                # output for the next command - start over with a new process
+                self.close()
+                raise
+    
+    def close(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+powershell = PowerShellSession()
+
 
 def clear_screen():
     os.system('cls' if os.name == 'nt' else 'clear')
 
 
 def run_powershell(command):
-    """Run PowerShell command and return output."""
+    """Run PowerShell command in the shared session and return output."""
     try:
-        result = subprocess.run(
-            ["powershell", "-NoProfile", "-ExecutionPolicy", "Bypass", "-Command", command],
-            capture_output=True,
-            text=True,
-            encoding="utf-8",
-            errors="replace"
-        )
-        return result.stdout.strip()
-    except:
+        return powershell.run(command)
+    except (OSError, ValueError):
         return ""
 
 
+def json_loads(data):
+    """Parse JSON text, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+@functools.lru_cache(maxsize=256)
+def is_builtin_audio(name):
+    """Check if an audio endpoint is built-in hardware, not a Bluetooth device."""
+    return BUILTIN_AUDIO_RE.search(name) is not None
+
+
 def get_connected_device():
     """Find a CONNECTED Bluetooth audio device."""
     
-    # Check audio endpoints - this shows actual connection status
+    # Check audio endpoints - this shows actual connection status.
+    # The CIM filter lets WMI return only connected endpoints.
     ps_audio = """
-    Get-PnpDevice -Class AudioEndpoint | Where-Object {$_.Status -eq 'OK'} |
-    Select-Object FriendlyName, InstanceId | ConvertTo-Json -Compress
+    Get-CimInstance -ClassName Win32_PnPEntity -Filter "PNPClass='AudioEndpoint' AND Status='OK'" |
+    Select-Object @{n='FriendlyName';e={$_.Name}}, @{n='InstanceId';e={$_.DeviceID}} |
+    ConvertTo-Json -Compress
     """
     output = run_powershell(ps_audio)
     
@@ -55,7 +216,7 @@ def get_connected_device():
         return None
     
     try:
-        data = json.loads(output)
+        data = json_loads(output)
         if isinstance(data, dict):
             data = [data]
         
@@ -66,31 +227,57 @@ def get_connected_device():
             if not name or not instance_id:
                 continue
             
-            name_lower = name.lower()
-            
             # Skip built-in audio devices
-            if "realtek" in name_lower:
-                continue
-            if "internal" in name_lower:
-                continue
-            if "speakers" in name_lower and "bluetooth" not in name_lower:
-                continue
-            if "microphone array" in name_lower:
+            if is_builtin_audio(name):
                 continue
                 
             # Found a connected Bluetooth audio device!
             return {"name": name, "instance_id": instance_id}
             
-    except:
+    except (ValueError, AttributeError, TypeError):
         pass
     
     return None
 
 
+def get_devnode_connected(instance_id):
+    """Check the device node in-process via cfgmgr32 (no PowerShell).
+    
+    Returns None when the API is not available.
+    """
+    try:
+        cfgmgr32 = ctypes.windll.cfgmgr32
+    except (AttributeError, OSError):
+        return None
+    
+    devinst = ctypes.c_ulong()
+    if cfgmgr32.CM_Locate_DevNodeW(ctypes.byref(devinst), instance_id, CM_LOCATE_DEVNODE_NORMAL) != CR_SUCCESS:
+        # Device node is not present - the endpoint went away
+        return False
+    
+    status = ctypes.c_ulong()
+    problem = ctypes.c_ulong()
+    if cfgmgr32.CM_Get_DevNode_Status(ctypes.byref(status), ctypes.byref(problem), devinst, 0) != CR_SUCCESS:
+        return False
+    
+    # Same as Get-PnpDevice reporting Status = OK
+    return bool(status.value & DN_STARTED) and problem.value == 0
+
+
+@functools.lru_cache(maxsize=8)
+def status_command(instance_id):
+    """PowerShell status query for a device, built once per monitored device."""
+    return f'(Get-PnpDevice -InstanceId "{instance_id}").Status'
+
+
 def is_device_connected(instance_id):
     """Check if device is still connected (Status = OK)."""
-    ps_command = f'(Get-PnpDevice -InstanceId "{instance_id}").Status'
-    status = run_powershell(ps_command)
+    connected = get_devnode_connected(instance_id)
+    if connected is not None:
+        return connected
+    
+    # Fall back to PowerShell
+    status = run_powershell(status_command(instance_id))
     return status.upper() == "OK"
 
 
@@ -99,7 +286,9 @@ def turn_off_screen():
     HWND_BROADCAST = 0xFFFF
     WM_SYSCOMMAND = 0x0112
     SC_MONITORPOWER = 0xF170
-    ctypes.windll.user32.SendMessageW(HWND_BROADCAST, WM_SYSCOMMAND, SC_MONITORPOWER, 2)
+    # PostMessage returns immediately; SendMessage to HWND_BROADCAST blocks
+    # until every top-level window has handled the message
+    ctypes.windll.user32.PostMessageW(HWND_BROADCAST, WM_SYSCOMMAND, SC_MONITORPOWER, 2)
 
 
 def monitor_device(device):
@@ -107,45 +296,58 @@ def monitor_device(device):
     name = device["name"]
     instance_id = device["instance_id"]
     
-    print()
-    print("=" * 60)
-    print(f"🎯 Monitoring: {name}")
-    print("=" * 60)
-    print()
-    print("📱 CONNECTED    → Screen stays ON")
-    print("📴 DISCONNECTED → Screen turns OFF")
-    print()
-    print("Press Ctrl+C to stop")
-    print("-" * 60)
-    print()
+    # Write the header in one go rather than a print() per line
+    sys.stdout.write("\n".join([
+        "",
+        "=" * 60,
+        f"🎯 Monitoring: {name}",
+        "=" * 60,
+        "",
+        "📱 CONNECTED    → Screen stays ON",
+        "📴 DISCONNECTED → Screen turns OFF",
+        "",
+        "Press Ctrl+C to stop",
+        "-" * 60,
+        "",
+        "",
+    ]))
+    sys.stdout.flush()
     
     miss_count = 0
     screen_off = False
+    out = ConsoleWriter()
     
     try:
         while True:
+            started = time.monotonic()
             connected = is_device_connected(instance_id)
+            ts = time.strftime('%H:%M:%S')
             
             if connected:
                 miss_count = 0
                 if screen_off:
-                    print(f"[{time.strftime('%H:%M:%S')}] 🔵 Device reconnected!")
+                    out.write(f"[{ts}] 🔵 Device reconnected!\n")
                     screen_off = False
                 else:
-                    print(f"[{time.strftime('%H:%M:%S')}] ✅ Connected - Screen ON", end="          \r")
+                    out.write(f"[{ts}] ✅ Connected - Screen ON          \r")
             else:
                 miss_count += 1
-                print(f"[{time.strftime('%H:%M:%S')}] ⚠️  Not connected ({miss_count}/{OUT_OF_RANGE_COUNT})        ")
+                line = f"[{ts}] ⚠️  Not connected ({miss_count}/{OUT_OF_RANGE_COUNT})        \n"
                 
                 if miss_count >= OUT_OF_RANGE_COUNT and not screen_off:
-                    print(f"[{time.strftime('%H:%M:%S')}] 😴 Device disconnected - Turning OFF screen...")
                     turn_off_screen()
                     screen_off = True
-                    print(f"[{time.strftime('%H:%M:%S')}] 💤 Screen OFF - Move mouse to wake")
+                    line += (f"[{ts}] 😴 Device disconnected - Turning OFF screen...\n"
+                             f"[{ts}] 💤 Screen OFF - Move mouse to wake\n")
+                
+                # One write per tick
+                out.write(line)
             
-            time.sleep(CHECK_INTERVAL)
+            # Subtract the time the check took so the cadence stays steady
+            time.sleep(max(0.0, CHECK_INTERVAL - (time.monotonic() - started)))
             
     except KeyboardInterrupt:
+        out.close()
         print("\n\n👋 Stopped. Goodbye!")
 
 
@@ -155,27 +357,39 @@ def main():
         sys.exit(1)
     
     clear_screen()
-    print("=" * 60)
-    print("🔵 BlueLock Simple - Auto Screen Control")
-    print("=" * 60)
-    print()
-    print("🔍 Looking for connected Bluetooth device...")
+    sys.stdout.write("\n".join([
+        "=" * 60,
+        "🔵 BlueLock Simple - Auto Screen Control",
+        "=" * 60,
+        "",
+        "🔍 Looking for connected Bluetooth device...",
+        "",
+    ]))
+    sys.stdout.flush()
     
-    # Auto-detect connected device
-    device = get_connected_device()
+    # PowerShell is only needed for discovery - status checks normally go
+    # through cfgmgr32, so don't keep an idle powershell.exe running
+    with powershell:
+        # Auto-detect connected device
+        device = get_connected_device()
     
     if not device:
-        print()
-        print("❌ No Bluetooth device is currently CONNECTED!")
-        print()
-        print("Please connect your Bluetooth device first, then run again.")
-        print()
+        sys.stdout.write("\n".join([
+            "",
+            "❌ No Bluetooth device is currently CONNECTED!",
+            "",
+            "Please connect your Bluetooth device first, then run again.",
+            "",
+            "",
+        ]))
         sys.exit(0)
     
     print(f"✅ Found: {device['name']}")
     
-    # Start monitoring
-    monitor_device(device)
+    # Start monitoring; the session restarts on demand if the status check
+    # has to fall back to PowerShell, and is closed again on exit
+    with powershell:
+        monitor_device(device)
 
 
 if __name__ == "__main__":